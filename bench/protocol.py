@@ -0,0 +1,92 @@
+"""
+Serial protocol benchmark against the simulated keypad in host/fake_pico.py.
+
+    python -m bench.protocol --commands 200 --refreshes 5
+
+Reports commands per second, p50/p99 round trip latency and the time to
+repaint every button.
+"""
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import List
+
+from host import pico, github
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+@contextmanager
+def fake_pico(poll_every: float):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'host.fake_pico', '--poll-every', str(poll_every)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        yield proc.stdout.readline().strip()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def bench_round_trips(client: pico.Client, count: int) -> List[float]:
+    samples = []
+    for i in range(count):
+        command = 'SET LED:{},{}*0*0'.format(i % 16, i % 256)
+        start = time.perf_counter()
+        client.send_command(command)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def full_refresh(client: pico.Client):
+    pull = github.Pull('https://github.com/robyoung/pico-notifier/pull/1', github.PullState.PENDING)
+    for button in range(16):
+        event = github.Event(pull, button)
+        await client.set_led(button, event.colour, 1.0)
+        await client.set_key(button, event.key_cmds)
+
+
+def bench_full_refresh(client: pico.Client, count: int) -> List[float]:
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        asyncio.run(full_refresh(client))
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--refreshes', type=int, default=5)
+    parser.add_argument(
+        '--poll-every',
+        type=float,
+        default=0.0,
+        help='device loop sleep, 0.1 matches the real keypad',
+    )
+    args = parser.parse_args()
+
+    with fake_pico(args.poll_every) as port, pico.client(port) as client:
+        client.send_command('IDENTIFY')
+
+        round_trips = bench_round_trips(client, args.commands)
+        refreshes = bench_full_refresh(client, args.refreshes)
+
+    print(f'commands/s:     {len(round_trips) / sum(round_trips):.1f}')
+    print(f'rtt p50:        {percentile(round_trips, 0.50) * 1000:.2f} ms')
+    print(f'rtt p99:        {percentile(round_trips, 0.99) * 1000:.2f} ms')
+    print(f'full refresh:   {statistics.median(refreshes) * 1000:.1f} ms (median of {len(refreshes)})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Event source benchmark replaying recorded or synthetic traffic on a virtual
+clock.
+
+    python -m bench.sources --pulls 500 --events 1000 --duration 3600
+    python -m bench.sources --recording day.json
+
+Reports how many events the sources generate per second of wall and CPU time.
+"""
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+from host import clock, gcal, github, runtime
+from host.replay import (
+    Recording,
+    ReplayCalendarClient,
+    ReplaySession,
+    calendar_key,
+    drain,
+    request_key,
+    run_replay,
+)
+
+OWNER = "robyoung"
+REPO = "pico-notifier"
+CALENDAR_ID = "primary"
+
+
+def synthetic_pull(recording: Recording, number: int):
+    repo_url = f"{github.BASE_URL}/repos/{OWNER}/{REPO}"
+    pull_url = f"{repo_url}/pulls/{number}"
+    sha = f"{number:040x}"
+    add = lambda key, body: recording.add(0, key, body)
+
+    add(
+        pull_url,
+        {
+            "html_url": f"https://github.com/{OWNER}/{REPO}/pull/{number}",
+            "_links": {"self": {"href": pull_url}},
+            "head": {"sha": sha, "repo": {"url": repo_url}},
+        },
+    )
+    add(pull_url + "/reviews", [{"state": "APPROVED"}] * (number % 3))
+    add(
+        f"{repo_url}/commits/{sha}/status",
+        {"state": "failed" if number % 7 == 0 else "success", "total_count": 1},
+    )
+    add(
+        f"{repo_url}/commits/{sha}/check-runs",
+        {"check_runs": [{"status": "queued" if number % 5 == 0 else "complete", "conclusion": "success"}]},
+    )
+    return {"url": f"{repo_url}/issues/{number}"}
+
+
+def synthetic_recording(pulls: int, events: int, duration: float) -> Recording:
+    recording = Recording(start=clock.now())
+
+    items = [synthetic_pull(recording, number) for number in range(1, pulls + 1)]
+    for is_open in (True, False):
+        params = github.search_params(is_open)
+        recording.add(0, request_key(github.BASE_URL + "/search/issues", params), {"items": items if is_open else []})
+
+    # at least a day of events with an hour to spare so reminders never run out
+    every = (max(duration, 24 * 60 * 60) + 60 * 60) / events
+    recording.add(
+        0,
+        calendar_key(CALENDAR_ID),
+        {
+            "items": [
+                {
+                    "summary": f"event {i}",
+                    "start": {"dateTime": (recording.start + timedelta(seconds=every * (i + 1))).isoformat()},
+                }
+                for i in range(events)
+            ]
+        },
+    )
+    return recording
+
+
+def bench(recording: Recording, duration: float, calendar_ids):
+    counts = {gcal.Event: 0, github.Event: 0}
+
+    def count(event):
+        counts[type(event)] += 1
+
+    async def main(replayer):
+        queue = asyncio.Queue()
+        sources = runtime.Runtime(
+            queue,
+            [
+                github.GitHubSource(headers={}),
+                gcal.CalendarSource(ReplayCalendarClient(replayer), calendar_ids),
+            ],
+            session=ReplaySession(replayer),
+        )
+        sources.start()
+        drain_task = asyncio.create_task(drain(queue, count))
+        await asyncio.sleep(duration)
+        drain_task.cancel()
+        await sources.close()
+        return replayer.requests
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    requests = run_replay(recording, main)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    total = sum(counts.values())
+    print(f"virtual time:   {duration:.0f} s")
+    print(f"wall time:      {wall:.2f} s")
+    print(f"cpu time:       {cpu:.2f} s")
+    print(f"requests:       {requests}")
+    print(f"github events:  {counts[github.Event]}")
+    print(f"gcal events:    {counts[gcal.Event]}")
+    print(f"events/s wall:  {total / wall:.1f}")
+    print(f"events/s cpu:   {total / cpu:.1f}")
+    for (source,), seconds in runtime.source_cpu.values.items():
+        print(f"{source + ' cpu:':<16}{seconds:.2f} s")
+    for (source,), restarts in runtime.source_restarts.values.items():
+        print(f"{source + ' restarts:':<16}{restarts:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--recording", help="replay a file from `python -m host.replay record`")
+    parser.add_argument("--calendar", action="append", dest="calendars", help="calendar ids in the recording")
+    parser.add_argument("--pulls", type=int, default=500)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60 * 60, help="virtual seconds to run for")
+    args = parser.parse_args()
+
+    if args.recording:
+        recording = Recording.load(args.recording)
+        calendar_ids = args.calendars or gcal.get_calendar_ids()
+    else:
+        recording = synthetic_recording(args.pulls, args.events, args.duration)
+        calendar_ids = [CALENDAR_ID]
+
+    bench(recording, args.duration, calendar_ids)
+
+
+if __name__ == "__main__":
+    main()
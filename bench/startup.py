@@ -0,0 +1,101 @@
+"""
+Host cold start benchmark.
+
+    python -m bench.startup --runs 5
+
+Starts `host.main` against the fake keypad with a snapshot of 11 pull requests
+and reports how long the import takes and how long until the keypad shows the
+snapshot. No event sources are reachable, so only the snapshot can paint it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from host import fake_pico, github
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATES = [github.PullState.PENDING, github.PullState.FAILED, github.PullState.MERGE]
+
+
+def write_snapshot(path: str) -> dict:
+    allocator = github.SlotAllocator()
+    pulls = [
+        github.Pull(f"https://github.com/robyoung/pico-notifier/pull/{number}", STATES[number % 3])
+        for number in range(allocator.size)
+    ]
+    expected = {event.offset + 4: event.colour + (1.0,) for event in allocator.update(pulls)}
+    with open(path, "w") as f:
+        json.dump({"saved": time.time(), "sections": {"github": allocator.to_snapshot()}}, f)
+    return expected
+
+
+def bench_import() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import host.main"], cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+def bench_paint(poll_every: float, timeout: float = 30.0) -> float:
+    fd, port = fake_pico.open_pty()
+    device = fake_pico.FakeDevice(fd, poll_every)
+    threading.Thread(target=device.run, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        snapshot_path = os.path.join(cwd, "snapshot.json")
+        expected = write_snapshot(snapshot_path)
+        env = {
+            **os.environ,
+            "PYTHONPATH": ROOT,
+            "PICO_PORT": port,
+            "SNAPSHOT_PATH": snapshot_path,
+            "METRICS_PORT": "0",
+        }
+        env.pop("GH_TOKEN", None)
+
+        start = time.perf_counter()
+        # run from an empty directory so no real secrets are picked up
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "host.main"],
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while any(device.pixels[button] != colour for button, colour in expected.items()):
+                if time.perf_counter() - start > timeout:
+                    raise Exception(f"keypad not painted in {timeout}s")
+                time.sleep(0.005)
+            return time.perf_counter() - start
+        finally:
+            proc.kill()
+            proc.wait()
+            device.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--poll-every",
+        type=float,
+        default=fake_pico.POLL_EVERY,
+        help="device loop sleep, the default matches the real keypad",
+    )
+    args = parser.parse_args()
+
+    imports = [bench_import() for _ in range(args.runs)]
+    paints = [bench_paint(args.poll_every) for _ in range(args.runs)]
+
+    print(f"import host.main:   {statistics.median(imports) * 1000:.0f} ms (median of {args.runs}, incl. interpreter start)")
+    print(f"snapshot painted:   {statistics.median(paints) * 1000:.0f} ms (median of {args.runs})")
+
+
+if __name__ == "__main__":
+    main()
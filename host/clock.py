@@ -0,0 +1,13 @@
+"""
+Wall clock used by the event sources.
+
+Replaced with a virtual clock when replaying recorded traffic, see replay.py.
+"""
+from datetime import datetime, timezone
+
+
+def wall_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+now = wall_now
@@ -0,0 +1,142 @@
+"""
+A simulated keypad for running the host without hardware.
+
+The real `pico/lib/notifier.py` protocol code runs behind a pseudo-terminal
+with stubbed pixels, keycodes and HID devices. Running this module prints the
+serial port path to use, eg.
+
+    python -m host.fake_pico &
+    PICO_PORT=/dev/pts/5 python -m host.main
+"""
+import argparse
+import os
+import pty
+import select
+import sys
+import time
+import tty
+from types import SimpleNamespace
+from typing import Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pico', 'lib'))
+
+import notifier  # noqa: E402
+
+
+NUM_PIXELS = 16
+# Matches the sleep at the end of the main loop in pico/code.py
+POLL_EVERY = 0.1
+
+
+class Keycode:
+    def __getattr__(self, name: str) -> str:
+        if not name.isupper():
+            raise AttributeError(name)
+        return name
+
+
+class Keyboard:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, *keys):
+        self.sent.append(keys)
+
+
+class Layout:
+    def __init__(self):
+        self.written = []
+
+    def write(self, value: str):
+        self.written.append(value)
+
+
+class FakeDevice:
+    def __init__(self, fd: int, poll_every: float = POLL_EVERY):
+        self.fd = fd
+        self.poll_every = poll_every
+        self.buffer = b''
+        self.lines = []
+        self.pixels = [(0, 0, 0)] * NUM_PIXELS
+        self.keysets = {}
+        self.kbd = Keyboard()
+        self.layout = Layout()
+        self.runtime = SimpleNamespace(serial_bytes_available=False)
+        self.running = True
+        # handle_command reads and writes the serial console through the
+        # builtins, so point them at the pseudo-terminal instead.
+        notifier.input = self._input
+        notifier.print = self._print
+
+    def _write(self, line: str):
+        os.write(self.fd, f'{line}\r\n'.encode('utf8'))
+
+    def _input(self) -> str:
+        line = self.lines.pop(0)
+        # the CircuitPython console echoes what it receives
+        self._write(line)
+        return line
+
+    def _print(self, *args):
+        self._write(' '.join(map(str, args)))
+
+    def _read(self, timeout: Optional[float]):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        self.buffer += os.read(self.fd, 4096)
+        *lines, self.buffer = self.buffer.replace(b'\r\n', b'\r').replace(b'\n', b'\r').split(b'\r')
+        self.lines.extend(line.decode('utf8') for line in lines)
+
+    def press(self, button: int):
+        if button in self.keysets:
+            self._print('LOG: execute keyset for button {}'.format(button))
+            notifier.execute_keyset(self.kbd, self.layout, time, self.pixels, self.keysets[button])
+
+    def step(self):
+        # with no poll interval block until there is something to do
+        self._read(0 if self.lines or self.poll_every else None)
+        self.runtime.serial_bytes_available = bool(self.lines)
+        notifier.handle_command(self.runtime, self.pixels, self.keysets, Keycode())
+        if self.poll_every:
+            time.sleep(self.poll_every)
+
+    def run(self):
+        while self.running:
+            self.step()
+
+    def stop(self):
+        self.running = False
+
+
+def open_pty() -> Tuple[int, str]:
+    """
+    Open a pseudo-terminal returning the device side file descriptor and the
+    path for the host to open.
+    """
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    # keep the slave open so the device survives the host reconnecting
+    return master, os.ttyname(slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--poll-every',
+        type=float,
+        default=POLL_EVERY,
+        help='seconds to sleep between commands, 0 to respond immediately',
+    )
+    args = parser.parse_args()
+
+    fd, path = open_pty()
+    print(path, flush=True)
+    try:
+        FakeDevice(fd, args.poll_every).run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
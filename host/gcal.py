@@ -3,15 +3,11 @@ import json
 from datetime import datetime, timezone, timedelta
 import asyncio
 import logging
-from typing import Tuple, Any, Mapping
-from dataclasses import dataclass
+import time
+from typing import Tuple, Any, Mapping, Optional
+from dataclasses import dataclass, field
 
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-
-from . import pico
+from . import clock, metrics, pico, runtime, snapshot
 
 
 _log = logging.getLogger(__name__)
@@ -29,8 +25,11 @@ TIME_DELTA_SOON = timedelta(minutes=5)
 
 @dataclass
 class Event:
+    source = "gcal"
+
     reminder: timedelta
     event: Mapping
+    created: float = field(default_factory=time.monotonic, compare=False, repr=False)
 
     @property
     def colour(self):
@@ -40,33 +39,49 @@ class Event:
             return pico.ORANGE
 
 
-async def send_events(queue: asyncio.Queue):
-    events_gen = poll_events()
-    events = await events_gen.asend(None)
-    create_new_events = lambda: asyncio.create_task(events_gen.asend(None))
-    create_next_event = lambda events: asyncio.create_task(wait_for_next_event(events))
-    new_events = create_new_events()
-    next_event = create_next_event(events)
-
-    while True:
-        done, _ = await asyncio.wait(
-            {new_events, next_event},
-            return_when=asyncio.FIRST_COMPLETED,
-        )
-        if new_events in done:
-            events = new_events.result()
-            new_events = create_new_events()
+class CalendarSource(runtime.Source):
+    name = 'gcal'
+    poll_every = POLL_EVENTS_EVERY
+
+    def __init__(self, client=None, calendar_ids=None):
+        self.client = client
+        self.calendar_ids = calendar_ids
+
+    async def run(self, ctx: runtime.Context):
+        events_gen = poll_events(ctx, self.client, self.calendar_ids)
+        # remind from the last known events until the calendars have been fetched
+        events = upcoming_events(snapshot.load('gcal') or [])
+        if not events:
+            events = await events_gen.asend(None)
+            snapshot.save('gcal', [compact_event(event) for event in events])
+        create_new_events = lambda: asyncio.create_task(events_gen.asend(None))
+        create_next_event = lambda events: asyncio.create_task(wait_for_next_event(events))
+        new_events = create_new_events()
+        next_event = create_next_event(events)
+
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {new_events, next_event},
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if new_events in done:
+                    events = new_events.result()
+                    snapshot.save('gcal', [compact_event(event) for event in events])
+                    new_events = create_new_events()
+                    next_event.cancel()
+                    next_event = create_next_event(events)
+                else:
+                    await ctx.emit(next_event.result())
+                    next_event = create_next_event(events)
+        finally:
+            new_events.cancel()
             next_event.cancel()
-            next_event = create_next_event(events)
-        else:
-            await queue.put(next_event.result())
-            next_event = create_next_event(events)
 
 
-async def poll_events():
-    while True:
-        yield await asyncio.to_thread(get_events)
-        await asyncio.sleep(POLL_EVENTS_EVERY)
+async def poll_events(ctx: runtime.Context, client=None, calendar_ids=None):
+    async for _ in ctx.every():
+        yield await ctx.run_blocking(get_events, client, calendar_ids)
 
 
 async def wait_for_next_event(events):
@@ -76,16 +91,19 @@ async def wait_for_next_event(events):
     - For each future event, produce two reminder events.
     - Find next event
     - Wait for it
+    With nothing to remind about wait for the next poll, which cancels this.
     """
-    reminder_stamp, reminder, event = get_next_event(events)
-    await asyncio.sleep((reminder_stamp - datetime.now(timezone.utc)).total_seconds())
+    if (next_event := get_next_event(events)) is None:
+        await asyncio.get_running_loop().create_future()
+    reminder_stamp, reminder, event = next_event
+    await asyncio.sleep((reminder_stamp - clock.now()).total_seconds())
     return Event(reminder, event)
 
 
-def get_next_event(events) -> Tuple[datetime, timedelta, Any]:
+def get_next_event(events) -> Optional[Tuple[datetime, timedelta, Any]]:
     reminders = [TIME_DELTA_SOON, TIME_DELTA_NOW]
     max_reminder = max(reminders)
-    now = datetime.now(timezone.utc)
+    now = clock.now()
     next_so_far = None
 
     events.sort(key=lambda event: event["start"]["dateTime"])
@@ -102,19 +120,19 @@ def get_next_event(events) -> Tuple[datetime, timedelta, Any]:
 
         for reminder in reminders:
             reminder_stamp = stamp - reminder
-            if reminder_stamp < now:
+            if reminder_stamp <= now:
                 continue
 
             if next_so_far is None or reminder_stamp < next_so_far[0]:
                 next_so_far = (reminder_stamp, reminder, event)
 
-    raise Exception("not found")
+    return next_so_far
 
 
 async def main_test():
     import asyncio
     queue = asyncio.Queue()
-    asyncio.create_task(send_events(queue))
+    runtime.Runtime(queue, [CalendarSource()]).start()
     while True:
         event = await queue.get()
 
@@ -128,28 +146,45 @@ def parse_stamp(stamp: str) -> datetime:
     return datetime.fromisoformat(stamp).astimezone(timezone.utc)
 
 
-def get_events():
+def get_events(client=None, calendar_ids=None):
     _log.debug('get events')
-    client = get_client()
-    now = datetime.utcnow().isoformat() + 'Z'
-
+    if client is None:
+        client = get_client()
+    if calendar_ids is None:
+        calendar_ids = get_calendar_ids()
+    now = clock.now().replace(tzinfo=None).isoformat() + 'Z'
+
+    events = []
+    for calendar_id in calendar_ids:
+        metrics.source_requests.inc(source="gcal")
+        events.extend(client.events().list(
+            calendarId=calendar_id,
+            maxResults=50,
+            timeMin=now,
+            singleEvents=True,
+            orderBy='startTime'
+        ).execute().get('items', []))
+    events.sort(key=lambda event: event['start']['dateTime'])
+    return events
+
+
+def get_calendar_ids():
     with open(CALENDAR_LIST_PATH) as f:
-        events = [
-            event
-            for calendar_id in json.load(f)
-            for event in client.events().list(
-                calendarId=calendar_id,
-                maxResults=50,
-                timeMin=now,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute().get('items', [])
-        ]
-        events.sort(key=lambda event: event['start']['dateTime'])
-        return events
+        return json.load(f)
+
+
+def upcoming_events(events):
+    now = clock.now()
+    return [event for event in events if parse_stamp(event['start']['dateTime']) > now]
+
+
+def compact_event(event):
+    return {'summary': event.get('summary', ''), 'start': {'dateTime': event['start']['dateTime']}}
 
 
 def get_client():
+    from googleapiclient.discovery import build
+
     return build('calendar', 'v3', credentials=get_credentials())
 
 
@@ -157,6 +192,10 @@ def get_credentials():
     """
     Taken from https://developers.google.com/calendar/quickstart/python
     """
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
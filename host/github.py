@@ -1,37 +1,55 @@
 import asyncio
+import importlib
 import os
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from enum import Enum, auto
 from typing import Mapping, Any, Optional
 from collections import defaultdict
 
 from loguru import logger
 
-import aiohttp
-from aiohttp.client_exceptions import ClientResponseError
-
-from . import pico
+from . import clock, metrics, pico, runtime, snapshot
 
 BASE_URL = "https://api.github.com"
+# search results can lag behind changes, so closed search windows overlap
+SEARCH_LAG = timedelta(seconds=60)
+
+# Buttons 4 to 14 are available for pull requests, 15 is the slack button.
+PULL_SLOTS = 11
 
 
-async def search_pulls(session, is_open: bool):
+def search_params(is_open: bool, updated_since: Optional[datetime] = None) -> dict[str, str]:
     open_closed = "open" if is_open else "closed"
-    params = {
-        "q": f"author:robyoung is:{open_closed} is:pr",
+    query = f"author:robyoung is:{open_closed} is:pr"
+    if updated_since is not None:
+        stamp = updated_since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        query += f" updated:>={stamp}"
+    return {
+        "q": query,
         "order": "desc",
         "sort": "updated",
     }
-    async with session.get(BASE_URL + "/search/issues", params=params) as resp:
+
+
+async def get_json(session, url: str, params: Optional[Mapping[str, str]] = None):
+    metrics.source_requests.inc(source="github")
+    async with session.get(url, params=params) as resp:
         return await resp.json()
 
 
+async def search_pulls(session, is_open: bool, updated_since: Optional[datetime] = None):
+    params = search_params(is_open, updated_since)
+    return await get_json(session, BASE_URL + "/search/issues", params)
+
+
 async def search_open_pulls(session):
     return await search_pulls(session, is_open=True)
 
 
-async def search_closed_pulls(session):
-    return await search_pulls(session, is_open=False)
+async def search_closed_pulls(session, updated_since: datetime):
+    return await search_pulls(session, is_open=False, updated_since=updated_since)
 
 
 async def get_raw_pull(session, search_result):
@@ -41,30 +59,24 @@ async def get_raw_pull(session, search_result):
     owner = parts[-4]
     path = f"/repos/{owner}/{repo}/pulls/{number}"
 
-    async with session.get(BASE_URL + path) as resp:
-        return await resp.json()
+    return await get_json(session, BASE_URL + path)
 
 
 async def get_reviews(session, pull):
-    async with session.get(pull["_links"]["self"]["href"] + "/reviews") as resp:
-        return await resp.json()
+    return await get_json(session, pull["_links"]["self"]["href"] + "/reviews")
 
 
 async def get_status(session, pull):
     head_sha = pull["head"]["sha"]
     repo_url = pull["head"]["repo"]["url"]
-    async with session.get(f"{repo_url}/commits/{head_sha}/status") as resp:
-        result = await resp.json()
-        return result
+    return await get_json(session, f"{repo_url}/commits/{head_sha}/status")
 
 
 async def get_checks(session, pull):
     head_sha = pull["head"]["sha"]
     repo_url = pull["head"]["repo"]["url"]
     path = f"{repo_url}/commits/{head_sha}/check-runs"
-    async with session.get(path) as resp:
-        result = await resp.json()
-        return result
+    return await get_json(session, path)
 
 
 # Get checks from most recent commit
@@ -75,7 +87,13 @@ class PullState(Enum):
     PENDING = auto()
     FAILED = auto()
     MERGE = auto()
+    # merged
     DONE = auto()
+    # closed without merging
+    CLOSED = auto()
+
+
+FINISHED = {PullState.DONE, PullState.CLOSED}
 
 
 @dataclass
@@ -86,8 +104,11 @@ class Pull:
 
 @dataclass
 class Event:
+    source = "github"
+
     pull: Pull
     offset: int
+    created: float = field(default_factory=time.monotonic, compare=False, repr=False)
 
     @property
     def colour(self):
@@ -99,10 +120,12 @@ class Event:
             return pico.ORANGE
         elif self.pull.state == PullState.DONE:
             return pico.GREEN
+        elif self.pull.state == PullState.CLOSED:
+            return pico.MAGENTA
 
     @property
     def key_cmds(self):
-        if self.pull.state == PullState.DONE:
+        if self.pull.state in FINISHED:
             return [pico.Key.leds(pico.OFF)]
         else:
             return [
@@ -122,6 +145,74 @@ class Event:
         return Event(Pull("", PullState.DONE), offset)
 
 
+# Lower sorts first when competing for a free slot.
+PULL_PRIORITY = {
+    PullState.FAILED: 0,
+    PullState.MERGE: 1,
+    PullState.PENDING: 2,
+}
+
+
+class SlotAllocator:
+    """
+    Pin each pull request to a button offset for as long as it is open.
+
+    Freed offsets are reused by the highest priority pull requests that did not
+    fit, and only offsets whose pull request changed produce an event, so a
+    poll where nothing changed produces no events at all.
+    """
+
+    def __init__(self, size: int = PULL_SLOTS):
+        self.size = size
+        self.slots: dict[str, int] = {}
+        self.shown: dict[int, Pull] = {}
+        self.overflow = 0
+
+    def update(self, pulls: list[Pull]) -> list[Event]:
+        live = {pull.url: pull for pull in pulls if pull.state not in FINISHED}
+        done = {pull.url: pull for pull in pulls if pull.state in FINISHED}
+
+        freed = {offset: url for url, offset in self.slots.items() if url not in live}
+        self.slots = {url: offset for url, offset in self.slots.items() if url in live}
+        taken = set(self.slots.values())
+        free = [offset for offset in range(self.size) if offset not in taken]
+        waiting = sorted(
+            (pull for url, pull in live.items() if url not in self.slots),
+            key=lambda pull: PULL_PRIORITY[pull.state],
+        )
+        for pull, offset in zip(waiting, free):
+            self.slots[pull.url] = offset
+        self.overflow = max(len(waiting) - len(free), 0)
+
+        events = []
+        for url, offset in self.slots.items():
+            pull = live[url]
+            if self.shown.get(offset) != pull:
+                self.shown[offset] = pull
+                events.append(Event(pull=pull, offset=offset))
+
+        taken = set(self.slots.values())
+        for offset in list(self.shown):
+            if offset not in taken:
+                del self.shown[offset]
+                if freed.get(offset) in done:
+                    events.append(Event(pull=done[freed[offset]], offset=offset))
+                else:
+                    events.append(Event.done(offset))
+
+        return sorted(events, key=lambda event: event.offset)
+
+    def to_snapshot(self) -> list:
+        return [[offset, pull.url, pull.state.name] for offset, pull in sorted(self.shown.items())]
+
+    def restore(self, pinned: list) -> list[Event]:
+        for offset, url, state in pinned:
+            if offset < self.size:
+                self.slots[url] = offset
+                self.shown[offset] = Pull(url, PullState[state])
+        return [Event(pull=pull, offset=offset) for offset, pull in sorted(self.shown.items())]
+
+
 async def resolve_open_pull(session, result: Mapping[str, Any]) -> Optional[Pull]:
     raw_pull = await get_raw_pull(session, result)
     reviews, status, checks = await asyncio.gather(
@@ -157,32 +248,29 @@ async def resolve_open_pull(session, result: Mapping[str, Any]) -> Optional[Pull
 async def get_open_pulls(session) -> list[Pull]:
     results = await search_open_pulls(session)
     pull_coros = [resolve_open_pull(session, result) for result in results["items"]]
-    return [
-        pull
-        for coro in asyncio.as_completed(pull_coros)
-        if (pull := await coro) is not None
-    ]
+    # gather keeps search order so slot allocation does not depend on timing
+    return [pull for pull in await asyncio.gather(*pull_coros) if pull is not None]
 
 
-async def resolve_closed_pull(result: Mapping[str, Any]) -> Optional[Pull]:
-    # TODO
-    return None
+def resolve_closed_pull(result: Mapping[str, Any]) -> Pull:
+    # the search result has everything needed, no need to fetch the pull
+    merged = result.get("pull_request", {}).get("merged_at") is not None
+    return Pull(url=result["html_url"], state=PullState.DONE if merged else PullState.CLOSED)
 
 
-async def get_closed_pulls(session) -> list[Pull]:
-    results = await search_open_pulls(session)
-    pull_coros = [resolve_closed_pull(result) for result in results["items"]]
-    return [
-        pull
-        for coro in asyncio.as_completed(pull_coros)
-        if (pull := await coro) is not None
-    ]
+async def get_closed_pulls(session, updated_since: datetime) -> list[Pull]:
+    """
+    Pulls closed or merged since `updated_since`, so the cost of a poll does
+    not grow with the number of pulls ever closed.
+    """
+    results = await search_closed_pulls(session, updated_since)
+    return [resolve_closed_pull(result) for result in results["items"]]
 
 
-async def get_pulls(session) -> list[Pull]:
+async def get_pulls(session, updated_since: datetime) -> list[Pull]:
     results = await asyncio.gather(
         get_open_pulls(session),
-        get_closed_pulls(session),
+        get_closed_pulls(session, updated_since),
     )
     return results[0] + results[1]
 
@@ -192,51 +280,60 @@ def get_headers():
         "Authorization": f"token {os.environ['GH_TOKEN']}",
     }
 
-async def send_events(queue: asyncio.Queue):
-    POLL_EVERY = 30
+class GitHubSource(runtime.Source):
+    name = "github"
+    poll_every = 30
 
-    MAX_SENT = 0
-    async with aiohttp.ClientSession(headers=get_headers()) as session:
-        while True:
+    def __init__(self, headers: Optional[dict[str, str]] = None):
+        self.headers = headers
+
+    async def run(self, ctx: runtime.Context):
+        # paint the last known pulls before paying for aiohttp and the first poll
+        allocator = SlotAllocator()
+        for event in allocator.restore(snapshot.load("github") or []):
+            await ctx.emit(event)
+
+        # import off the loop so the keypads can be opened meanwhile
+        await ctx.run_blocking(importlib.import_module, "aiohttp")
+        from aiohttp.client_exceptions import ClientResponseError
+
+        session = ctx.http(get_headers() if self.headers is None else self.headers)
+        # start the closed search window a poll before the first poll
+        last_poll = clock.now() - timedelta(seconds=self.poll_every)
+        async for _ in ctx.every():
             try:
                 logger.debug("get pulls")
-                pulls = await get_pulls(session)
+                started = clock.now()
+                pulls = await get_pulls(session, last_poll - SEARCH_LAG)
+                last_poll = started
 
-                # handle DONE
+                # handle DONE and CLOSED
                 for pull in pulls:
-                    if pull.state != PullState.DONE:
+                    if pull.state not in FINISHED:
                         continue
-                    logger.debug(f"done {pull.url}")
+                    logger.debug(f"{pull.state.name.lower()} {pull.url}")
 
-                # handle not DONE
-                offset = 0
                 sent = defaultdict(int)
                 for pull in pulls:
                     sent[pull.state] += 1
-                    if pull.state == PullState.DONE:
-                        continue
-                    event = Event(pull=pull, offset=offset)
+                logger.info("found {event_details}", event_details=", ".join([f"{num} {state} pulls" for state, num in sent.items()]))
+
+                # only changed buttons are sent
+                for event in allocator.update(pulls):
                     logger.debug("send update event")
-                    await queue.put(event)
-                    offset += 1
-                    if offset > MAX_SENT:
-                        MAX_SENT = offset
-                logger.info("sent {event_details}", event_details=", ".join([f"{num} {state} events" for state, num in sent.items()]))
-                current_max = offset
-                while offset < MAX_SENT:
-                    await queue.put(Event.done(offset))
-                    offset += 1
-
-                MAX_SENT = current_max
+                    await ctx.emit(event)
+                if allocator.overflow:
+                    logger.info(f"{allocator.overflow} pulls waiting for a free button")
+                snapshot.save("github", allocator.to_snapshot())
             except ClientResponseError as e:
                 logger.exception(e)
-            finally:
-                await asyncio.sleep(POLL_EVERY)
 
 
 async def main():
+    import aiohttp
+
     async with aiohttp.ClientSession(headers=get_headers()) as session:
-        await get_pulls(session)
+        await get_pulls(session, clock.now() - timedelta(days=1))
 
 
 if __name__ == "__main__":
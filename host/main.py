@@ -1,11 +1,12 @@
 import asyncio
 import sys
+from typing import Optional
 
 from loguru import logger
 
 sys.path.append("./host")
 
-from host import gcal, pico, github
+from host import gcal, metrics, pico, pool, github, runtime
 
 logger.remove()
 logger.add(sys.stderr, level="INFO")
@@ -24,14 +25,8 @@ async def handle_event(client, event):
         await client.set_key(button, event.key_cmds)
 
 
-@logger.catch
-async def main():
-    queue = asyncio.Queue()
-    asyncio.create_task(gcal.send_events(queue))
-    asyncio.create_task(github.send_events(queue))
-
-    with pico.client() as client:
-        print('Identifying as: {}'.format(await client.identify()))
+async def setup(client):
+    async with client.batch():
         # clear all leds
         await client.set_led(tuple(range(16)), pico.OFF)
 
@@ -47,13 +42,45 @@ async def main():
         ])
         await client.set_led(15, pico.CYAN, 0.5)
 
-        while True:
-            try:
-                event = await asyncio.wait_for(queue.get(), timeout=10.0)
-            except asyncio.TimeoutError:
-                logger.debug('No new event')
-            else:
-                await handle_event(client, event)
+
+async def serve_metrics(port: int = metrics.METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    try:
+        return await metrics.serve(port=port)
+    except OSError as e:
+        # metrics are optional, the keypads are not
+        logger.warning(f'not serving metrics: {e}')
+        return None
+
+
+@logger.catch
+async def main():
+    queue = asyncio.Queue()
+    sources = runtime.Runtime(queue, [gcal.CalendarSource(), github.GitHubSource()])
+    sources.start()
+    await serve_metrics()
+
+    async with pool.open_devices() as devices:
+        if not devices:
+            raise Exception('no keypads found')
+        for device in devices:
+            print('Identifying as: {}'.format(device.user_agent))
+
+        device_pool = pool.DevicePool(devices, handle_event, setup)
+        # events restored from the snapshot go out with the setup
+        while not queue.empty():
+            device_pool.dispatch(queue.get_nowait())
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=10.0)
+                except asyncio.TimeoutError:
+                    logger.debug('No new event')
+                else:
+                    metrics.queue_depth.set(queue.qsize())
+                    device_pool.dispatch(event)
+        finally:
+            await device_pool.close()
+            await sources.close()
 
 
 if __name__ == '__main__':
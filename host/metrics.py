@@ -0,0 +1,167 @@
+"""
+Host side instrumentation exposed in the Prometheus text format.
+
+    curl http://127.0.0.1:9108/metrics
+"""
+import asyncio
+import bisect
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9108'))
+
+# seconds, from a fast serial round trip up to a slow GitHub poll
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY: List["_Metric"] = []
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, **extra: str) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # per label values: a count per bucket (not cumulative), the sum and the count
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        try:
+            counts, total = self.values[key]
+        except KeyError:
+            counts, total = self.values[key] = ([0] * len(self.buckets), [0.0])
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, le=_format_value(bucket))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total[0])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        # every path gets the metrics, so only drain the request headers
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        body = render().encode('utf8')
+        writer.write(
+            b'HTTP/1.0 200 OK\r\n'
+            b'Content-Type: text/plain; version=0.0.4\r\n'
+            + f'Content-Length: {len(body)}\r\n\r\n'.encode('utf8')
+            + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT) -> asyncio.AbstractServer:
+    return await asyncio.start_server(_handle, host, port)
+
+
+# serial link
+command_seconds = Histogram(
+    'pico_command_seconds', 'Serial command round trip time.', ['command']
+)
+command_errors = Counter(
+    'pico_command_errors_total', 'Serial commands answered with an error.', ['command']
+)
+
+# event sources
+poll_seconds = Histogram(
+    'source_poll_seconds', 'Time taken to poll an event source.', ['source']
+)
+source_requests = Counter(
+    'source_requests_total', 'Requests made to an event source API.', ['source']
+)
+
+# event handling
+queue_depth = Gauge('event_queue_depth', 'Events waiting to be handled.')
+event_latency = Histogram(
+    'event_latency_seconds', 'Time from an event being created to its LEDs being set.', ['source']
+)
@@ -1,16 +1,34 @@
 import asyncio
-from contextlib import contextmanager
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from itertools import count
+import os
 import time
-from typing import Tuple, Optional, List, Union
+from typing import Dict, Set, Tuple, Optional, List, Union
 from binascii import hexlify
 
 import serial
 
-from . import shell
+from . import metrics, shell
 
 
+DEFAULT_PORT = os.environ.get('PICO_PORT', '/dev/ttyACM0')
+SERIAL_OPTIONS = dict(baudrate=115200, timeout=0.05)
+COMMAND_TIMEOUT = 2.0
+# the keypad does not read serial while it runs a keyset, the slack keyset
+# alone sleeps for 2.2s, so once it logs one give it this long to answer
+KEYSET_TIMEOUT = 10.0
+RECONNECT_MIN = 0.1
+RECONNECT_MAX = 2.0
+# printed by CircuitPython every time code.py starts
+RELOAD_MARKER = 'code.py output:'
+# printed by code.py before it runs the keyset of a pressed button
+KEYSET_MARKER = 'LOG: execute keyset for button '
+
 Colour = Tuple[int, int, int]
 Buttons = Union[int, Tuple[int, ...]]
+# set order, buttons it was set with and key commands
+KeySet = Tuple[int, Tuple[int, ...], str]
 
 OFF = (0, 0, 0)
 RED = (255, 0, 0)
@@ -42,59 +60,255 @@ class Key:
         return f'l{_encode_colour(colour, brightness)}'
 
 
+class CommandTimeout(serial.SerialException):
+    pass
+
+
 @contextmanager
-def client():
-    with serial.Serial('/dev/ttyACM0', baudrate=115200, timeout=0.05) as ser:
-        yield Client(ser)
+def client(port: str = DEFAULT_PORT, serial_number: Optional[str] = None):
+    _client = Client(serial.Serial(port, **SERIAL_OPTIONS), serial_number)
+    try:
+        yield _client
+    finally:
+        # reconnecting replaces the serial port
+        _client.ser.close()
 
 
 class Client:
-    def __init__(self, ser: serial.Serial):
+    def __init__(self, ser: serial.Serial, serial_number: Optional[str] = None):
         self.ser = ser
+        self.port = ser.port
+        # USB serial number, to find the keypad again if it comes back on
+        # another port
+        self.serial_number = serial_number
+        # desired state of each button, replayed after reconnecting
+        self.leds: Dict[int, str] = {}
+        self.keys: Dict[int, KeySet] = {}
+        self.key_order = count()
+        self.reloaded = False
+        self.batched: Optional[Set[int]] = None
 
     def read_line(self) -> str:
-        return self.ser.readline().decode('utf8').strip()
+        return self.ser.readline().decode('utf8', errors='replace').strip()
+
+    def log(self, line: str):
+        print(f'{shell.LOG}{line}{shell.ENDC}')
+        if line.startswith(KEYSET_MARKER):
+            self.pressed(int(line[len(KEYSET_MARKER):]))
+
+    def pressed(self, button: int):
+        """
+        Keep the desired LEDs in step with the LED commands of a pressed
+        button's keyset, so a resync does not bring back what was cleared.
+        """
+        if (key := self.keys.get(button)) is None:
+            return
+        _, key_buttons, key_cmds = key
+        for key_cmd in key_cmds.split('/'):
+            if key_cmd.startswith('l'):
+                for key_button in key_buttons:
+                    self.leds[key_button] = key_cmd[1:]
 
     def read_until_not_log(self):
         while True:
             line = self.read_line()
             if line.startswith('LOG'):
-                print(f'{shell.LOG}{line}{shell.ENDC}')
+                self.log(line)
             else:
                 return line
 
-    def read_until(self, prefix: str):
+    def read_pending(self):
+        """
+        Read anything the keypad printed since the last command.
+        """
+        while (line := self.read_until_not_log()) != "":
+            if RELOAD_MARKER in line:
+                self.reloaded = True
+            print(f'{shell.PRE}PRE: {line}{shell.ENDC}')
+
+    def read_until(self, prefix: str, timeout: float = COMMAND_TIMEOUT):
+        deadline = time.monotonic() + timeout
         while True:
-            line = self.read_until_not_log()
+            # checked on every line so a keypad stuck printing tracebacks
+            # times out too
+            if time.monotonic() > deadline:
+                raise CommandTimeout(f'no response from {self.port} in {timeout}s')
+            line = self.read_line()
             if line == "":
                 continue
+            elif line.startswith('LOG'):
+                self.log(line)
+                # a key was pressed, the keypad is busy rather than gone
+                deadline = max(deadline, time.monotonic() + KEYSET_TIMEOUT)
             elif line.startswith(prefix):
                 return line
             else:
+                if RELOAD_MARKER in line:
+                    self.reloaded = True
                 print(f'{shell.SKIP}{line}{shell.ENDC}')
 
-    async def async_send_command(self, command: str):
-        return await asyncio.to_thread(self.send_command, command)
+    @asynccontextmanager
+    async def batch(self):
+        """
+        Hold back LED and key changes, on exit send the resulting state of the
+        buttons they touched with buttons in the same state set together.
+        A batch inside another one is sent with it.
+        """
+        if self.batched is not None:
+            yield
+            return
+        self.batched = set()
+        try:
+            yield
+        finally:
+            buttons, self.batched = self.batched, None
+        if buttons:
+            await self.async_send_batch(self.resync_commands(buttons))
+
+    async def async_send_batch(self, commands: List[str]):
+        try:
+            await asyncio.to_thread(self.send_batch, commands)
+        except (serial.SerialException, OSError) as e:
+            print(f'{shell.PRE}lost {self.port}: {e}{shell.ENDC}')
+            # the resync includes every command in the batch
+            await self.reconnect()
+            return
+
+        if self.reloaded:
+            print(f'{shell.PRE}{self.port} reloaded{shell.ENDC}')
+            await asyncio.to_thread(self.resync)
+
+    async def async_send_command(self, command: str, stateful: bool = False):
+        while True:
+            try:
+                result = await asyncio.to_thread(self.send_command, command)
+            except (serial.SerialException, OSError) as e:
+                print(f'{shell.PRE}lost {self.port}: {e}{shell.ENDC}')
+                await self.reconnect()
+                # the resync after reconnecting already sent stateful commands
+                if stateful:
+                    return 'OK'
+                continue
+
+            if self.reloaded:
+                print(f'{shell.PRE}{self.port} reloaded{shell.ENDC}')
+                await asyncio.to_thread(self.resync)
+            return result
 
     def send_command(self, command: str):
-        if (line := self.read_until_not_log()) != "":
-            print(f'{shell.PRE}PRE: {line}{shell.ENDC}')
+        start = time.perf_counter()
+        name = command.split(':', 1)[0]
+
+        self.read_pending()
 
         self.ser.write(f'{command}\r'.encode('utf8'))
         self.ser.flush()
         time.sleep(0.05)
 
-        self.read_until(command)
-        result = self.read_until_not_log()
+        try:
+            return self.read_result(command)
+        finally:
+            metrics.command_seconds.observe(time.perf_counter() - start, command=name)
+
+    def send_batch(self, commands: List[str]) -> List[str]:
+        """
+        Write all of the commands before reading any of the results.
+        """
+        self.read_pending()
+
+        self.ser.write(''.join(f'{command}\r' for command in commands).encode('utf8'))
+        self.ser.flush()
 
-        # print(f'out_command={out_command}')
-        # print(f'result={result}')
+        results, errors = [], []
+        start = time.perf_counter()
+        for command in commands:
+            try:
+                results.append(self.read_result(command))
+            except serial.SerialException:
+                raise
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # the keypad runs the commands one after the other, so each
+                # one takes from the previous result to its own
+                end = time.perf_counter()
+                metrics.command_seconds.observe(end - start, command=command.split(':', 1)[0])
+                start = end
+        if errors:
+            raise errors[0]
+        return results
+
+    def read_result(self, command: str) -> str:
+        self.read_until(command)
+        result = self.read_until('')
 
         if result.startswith('ERROR'):
+            metrics.command_errors.inc(command=command.split(':', 1)[0])
             raise Exception(result.replace('ERROR:', '').strip())
 
         return result
 
+    async def reconnect(self):
+        # back off here rather than in the thread so cancelling stops it
+        delay = RECONNECT_MIN
+        while True:
+            try:
+                await asyncio.to_thread(self.reopen)
+                print(f'{shell.PRE}reconnected {self.port}{shell.ENDC}')
+                return
+            except (serial.SerialException, OSError) as e:
+                print(f'{shell.PRE}reconnecting {self.port} in {delay}s: {e}{shell.ENDC}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+
+    def reopen(self):
+        self.ser.close()
+        if self.serial_number is not None:
+            from .pool import discover_ports
+
+            ports = [port for port, number in discover_ports().items() if number == self.serial_number]
+            if not ports:
+                raise serial.SerialException(f'{self.serial_number} is not plugged in')
+            self.port = ports[0]
+        self.ser = serial.Serial(self.port, **SERIAL_OPTIONS)
+        self.send_command('IDENTIFY')
+        self.resync()
+
+    def resync(self):
+        self.reloaded = False
+        if commands := self.resync_commands():
+            self.send_batch(commands)
+
+    def resync_commands(self, buttons: Optional[Set[int]] = None) -> List[str]:
+        """
+        Commands to restore the desired state of the buttons (all by default),
+        buttons with the same state are set together.
+        """
+        leds = defaultdict(list)
+        for button, colour in sorted(self.leds.items()):
+            if buttons is None or button in buttons:
+                leds[colour].append(button)
+
+        # keysets go with every button they were set with, as their LED
+        # commands apply to all of them, so any later keyset on one of those
+        # buttons has to be sent again after it
+        keys = {key for button, key in self.keys.items() if buttons is None or button in buttons}
+        pending = list(keys)
+        while pending:
+            _, key_buttons, _ = pending.pop()
+            for button in key_buttons:
+                if (key := self.keys[button]) not in keys:
+                    keys.add(key)
+                    pending.append(key)
+
+        return [
+            f'SET LED:{_encode_buttons(tuple(buttons))},{colour}'
+            for colour, buttons in leds.items()
+        ] + [
+            f'SET KEY:{_encode_buttons(key_buttons)},{key_cmds}'
+            for _, key_buttons, key_cmds in sorted(keys)
+        ]
+
     async def identify(self):
         return await self.async_send_command('IDENTIFY')
 
@@ -104,7 +318,12 @@ class Client:
 
         command = f'SET LED:{_buttons},{_colour}'
 
-        await self.async_send_command(command)
+        for button in _iter_buttons(buttons):
+            self.leds[button] = _colour
+        if self.batched is not None:
+            self.batched.update(_iter_buttons(buttons))
+            return
+        await self.async_send_command(command, stateful=True)
 
 
     async def set_key(self, buttons: Buttons, key_commands: List[str]):
@@ -113,13 +332,23 @@ class Client:
 
         command = f'SET KEY:{_buttons},{_key_cmds}'
 
-        await self.async_send_command(command)
+        key = (next(self.key_order), _iter_buttons(buttons), _key_cmds)
+        for button in _iter_buttons(buttons):
+            self.keys[button] = key
+        if self.batched is not None:
+            self.batched.update(_iter_buttons(buttons))
+            return
+        await self.async_send_command(command, stateful=True)
 
 
-def _encode_buttons(buttons: Buttons) -> str:
+def _iter_buttons(buttons: Buttons) -> Tuple[int, ...]:
     if isinstance(buttons, int):
-        buttons = (buttons,)
-    return '/'.join(map(str, buttons))
+        return (buttons,)
+    return tuple(buttons)
+
+
+def _encode_buttons(buttons: Buttons) -> str:
+    return '/'.join(map(str, _iter_buttons(buttons)))
 
 def _encode_colour(colour: Colour, brightness: Optional[float]) -> str:
     if brightness is None:
@@ -0,0 +1,181 @@
+"""
+Drive several keypads from one host process.
+
+Keypads are found by USB vendor and product id and confirmed with `IDENTIFY`.
+Each one gets its own queue and worker so a slow or reconnecting keypad does
+not hold up the others. Which event sources a keypad shows can be limited in
+`secrets/devices.json`, keyed by USB serial number (or port), eg.
+
+    {"E6614C311B4A8E2B": ["gcal"]}
+
+Set `PICO_PORT` to a comma separated list of ports to skip discovery.
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import ExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from loguru import logger
+from serial import SerialException
+from serial.tools import list_ports
+
+from . import metrics, pico
+
+# CircuitPython on the Raspberry Pi Pico
+PICO_VID = 0x239A
+PICO_PID = 0x80F4
+
+DEVICES_PATH = "secrets/devices.json"
+USER_AGENT_PREFIX = "Notifier/"
+
+Handler = Callable[[pico.Client, Any], Awaitable[None]]
+Setup = Callable[[pico.Client], Awaitable[None]]
+
+device_queue_depth = metrics.Gauge(
+    "device_queue_depth", "Events waiting to be sent to a keypad.", ["device"]
+)
+
+
+@dataclass
+class Device:
+    port: str
+    serial_number: Optional[str]
+    client: pico.Client
+    user_agent: str
+    # None shows every source
+    sources: Optional[Set[str]] = None
+
+    @property
+    def name(self) -> str:
+        return self.serial_number or self.port
+
+    def accepts(self, event) -> bool:
+        return self.sources is None or event.source in self.sources
+
+
+def discover_ports() -> Dict[str, Optional[str]]:
+    """
+    Find keypad serial ports, mapped to their USB serial numbers.
+    """
+    if "PICO_PORT" in os.environ:
+        return {port: None for port in os.environ["PICO_PORT"].split(",")}
+
+    return {
+        port.device: port.serial_number
+        for port in sorted(list_ports.comports(), key=lambda port: port.device)
+        if (port.vid, port.pid) == (PICO_VID, PICO_PID)
+    }
+
+
+def load_device_sources() -> Dict[str, Set[str]]:
+    if not os.path.exists(DEVICES_PATH):
+        return {}
+    with open(DEVICES_PATH) as f:
+        return {name: set(sources) for name, sources in json.load(f).items()}
+
+
+async def identify(port: str, serial_number: Optional[str], client: pico.Client) -> Optional[Device]:
+    try:
+        # not client.identify(), that would keep reconnecting to a port that
+        # is not a keypad
+        user_agent = await asyncio.to_thread(client.send_command, "IDENTIFY")
+    except (SerialException, OSError) as e:
+        logger.warning(f"no answer from {port}: {e!r}")
+        return None
+
+    if not user_agent.startswith(USER_AGENT_PREFIX):
+        logger.warning(f"skipping {port}, identified as {user_agent}")
+        return None
+
+    return Device(port, serial_number, client, user_agent)
+
+
+@asynccontextmanager
+async def open_devices() -> AsyncIterator[List[Device]]:
+    """
+    Open and identify every keypad found, closing them all on exit.
+    """
+    ports = discover_ports()
+    sources = load_device_sources()
+    with ExitStack() as stack:
+        clients = {}
+        for port in ports:
+            try:
+                clients[port] = stack.enter_context(pico.client(port, ports[port]))
+            except SerialException as e:
+                logger.warning(f"cannot open {port}: {e}")
+
+        identified = await asyncio.gather(*(
+            identify(port, ports[port], client) for port, client in clients.items()
+        ))
+        devices = [device for device in identified if device is not None]
+        for device in devices:
+            device.sources = sources.get(device.name, sources.get(device.port))
+            logger.info(f"using {device.user_agent} on {device.port}")
+
+        yield devices
+
+
+class DevicePool:
+    """
+    Fan events out to every keypad that accepts them.
+    """
+
+    def __init__(self, devices: List[Device], handler: Handler, setup: Optional[Setup] = None):
+        self.handler = handler
+        self.setup = setup
+        self.devices = {device.port: device for device in devices}
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        for device in devices:
+            self.queues[device.port] = asyncio.Queue()
+            self.tasks[device.port] = asyncio.create_task(self._run(device))
+
+    def dispatch(self, event):
+        for port, device in self.devices.items():
+            if device.accepts(event):
+                queue = self.queues[port]
+                queue.put_nowait(event)
+                device_queue_depth.set(queue.qsize(), device=device.name)
+
+    async def _run(self, device: Device):
+        queue = self.queues[device.port]
+        # set up in the worker so one slow keypad does not hold up the others,
+        # in one batch with any events already waiting, eg. from the snapshot
+        setup = self.setup
+        while True:
+            # everything that queued up while the last batch was sent goes
+            # out in the next one
+            events = [] if setup is not None else [await queue.get()]
+            while not queue.empty():
+                events.append(queue.get_nowait())
+            device_queue_depth.set(0, device=device.name)
+            try:
+                async with device.client.batch():
+                    if setup is not None:
+                        await setup(device.client)
+                    for event in events:
+                        await self.handler(device.client, event)
+                now = time.monotonic()
+                for event in events:
+                    metrics.event_latency.observe(now - event.created, source=event.source)
+            except (SerialException, OSError) as e:
+                logger.error(f"dropping {device.name} on {device.port}: {e!r}")
+                self.remove(device.port)
+                return
+            except Exception as e:
+                logger.exception(e)
+            setup = None
+
+    def remove(self, port: str):
+        device = self.devices.pop(port)
+        self.queues.pop(port)
+        device_queue_depth.set(0, device=device.name)
+
+    async def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
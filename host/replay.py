@@ -0,0 +1,322 @@
+"""
+Record and replay event source traffic.
+
+A recording holds every GitHub and Google Calendar response seen by the
+sources, stamped with the number of seconds since recording started. Replaying
+serves them back through stand-ins for the aiohttp session and calendar client
+on an event loop whose clock only advances when everything is waiting, so a
+day of polling runs in seconds.
+
+    GH_TOKEN=... python -m host.replay record --duration 86400 day.json
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import re
+import selectors
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Mapping, Optional, Tuple
+from urllib.parse import urlencode
+
+from . import clock, snapshot
+
+
+# closed pull searches are windowed on the time of the previous poll
+_UPDATED_SINCE = re.compile(r" updated:>=\S+")
+
+
+def request_key(url: str, params: Optional[Mapping[str, str]] = None) -> str:
+    if params:
+        params = {name: _UPDATED_SINCE.sub("", value) for name, value in params.items()}
+        return f"{url}?{urlencode(sorted(params.items()))}"
+    return url
+
+
+def calendar_key(calendar_id: str) -> str:
+    return f"calendar:{calendar_id}"
+
+
+@dataclass
+class Recording:
+    start: datetime
+    responses: List[Tuple[float, str, Any]] = field(default_factory=list)
+
+    def add(self, at: float, key: str, body: Any):
+        self.responses.append((at, key, body))
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(
+                {"start": self.start.isoformat(), "responses": self.responses}, f
+            )
+
+    @staticmethod
+    def load(path: str) -> "Recording":
+        with open(path) as f:
+            data = json.load(f)
+        return Recording(
+            start=datetime.fromisoformat(data["start"]),
+            responses=[tuple(response) for response in data["responses"]],
+        )
+
+
+class Replayer:
+    """
+    Serve the most recent response recorded at or before the current time.
+    """
+
+    def __init__(self, recording: Recording, now: Callable[[], datetime]):
+        self.start = recording.start
+        self.now = now
+        self.requests = 0
+        self.responses: dict[str, Tuple[List[float], List[Any]]] = {}
+        for at, key, body in sorted(recording.responses, key=lambda r: r[0]):
+            stamps, bodies = self.responses.setdefault(key, ([], []))
+            stamps.append(at)
+            bodies.append(body)
+
+    def get(self, key: str) -> Any:
+        self.requests += 1
+        try:
+            stamps, bodies = self.responses[key]
+        except KeyError:
+            raise KeyError(f"nothing recorded for {key}")
+        at = (self.now() - self.start).total_seconds()
+        return bodies[max(bisect.bisect_right(stamps, at) - 1, 0)]
+
+
+# aiohttp stand-ins
+
+
+class ReplayResponse:
+    def __init__(self, body: Any):
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class ReplaySession:
+    def __init__(self, replayer: Replayer):
+        self.replayer = replayer
+
+    def get(self, url: str, params: Optional[Mapping[str, str]] = None, **kwargs):
+        return ReplayResponse(self.replayer.get(request_key(url, params)))
+
+
+class RecordingResponse:
+    def __init__(self, session: "RecordingSession", key: str, request):
+        self.session = session
+        self.key = key
+        self.request = request
+
+    async def json(self):
+        body = await self.resp.json()
+        self.session.recording.add(self.session.elapsed(), self.key, body)
+        return body
+
+    async def __aenter__(self):
+        self.resp = await self.request.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.request.__aexit__(*exc)
+
+
+class RecordingSession:
+    def __init__(self, session, recording: Recording):
+        self.session = session
+        self.recording = recording
+
+    def elapsed(self) -> float:
+        return (clock.now() - self.recording.start).total_seconds()
+
+    def get(self, url: str, params: Optional[Mapping[str, str]] = None, **kwargs):
+        return RecordingResponse(
+            self, request_key(url, params), self.session.get(url, params=params, **kwargs)
+        )
+
+
+# googleapiclient stand-ins
+
+
+class _Request:
+    def __init__(self, execute: Callable[[], Any]):
+        self.execute = execute
+
+
+class _Events:
+    def __init__(self, list_events: Callable[..., Any]):
+        self._list_events = list_events
+
+    def list(self, **kwargs):
+        return _Request(lambda: self._list_events(**kwargs))
+
+
+class ReplayCalendarClient:
+    """
+    Recorded events are filtered by `timeMin` and `maxResults` like the API
+    does, so a single snapshot of a calendar can be replayed across a day.
+    """
+
+    def __init__(self, replayer: Replayer):
+        self.replayer = replayer
+
+    def events(self):
+        return _Events(self._list_events)
+
+    def _list_events(self, calendarId, timeMin, maxResults, **kwargs):
+        from .gcal import parse_stamp
+
+        time_min = parse_stamp(timeMin)
+        response = self.replayer.get(calendar_key(calendarId))
+        items = [
+            item
+            for item in response.get("items", [])
+            if parse_stamp(item["start"]["dateTime"]) >= time_min
+        ]
+        return {**response, "items": items[:maxResults]}
+
+
+class RecordingCalendarClient:
+    def __init__(self, client, recording: Recording):
+        self.client = client
+        self.recording = recording
+
+    def events(self):
+        return _Events(self._list_events)
+
+    def _list_events(self, calendarId, **kwargs):
+        response = self.client.events().list(calendarId=calendarId, **kwargs).execute()
+        at = (clock.now() - self.recording.start).total_seconds()
+        self.recording.add(at, calendar_key(calendarId), response)
+        return response
+
+
+# virtual clock
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    def __init__(self):
+        super().__init__()
+        self.loop: Optional["VirtualClockLoop"] = None
+
+    def select(self, timeout=None):
+        # Block for real while work is running in threads, their results
+        # arrive through the loop's self-pipe.
+        if timeout == 0 or timeout is None or self.loop._executor_jobs:
+            return super().select(timeout)
+        ready = super().select(0)
+        if not ready:
+            self.loop._offset += timeout
+        return ready
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    An event loop where time jumps straight to the next scheduled callback
+    whenever nothing is ready to run.
+    """
+
+    def __init__(self, start: datetime):
+        selector = _VirtualSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.start = start
+        self._offset = 0.0
+        self._executor_jobs = 0
+
+    def time(self) -> float:
+        return self._offset
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self._offset)
+
+    def run_in_executor(self, executor, func, *args):
+        self._executor_jobs += 1
+        future = super().run_in_executor(executor, func, *args)
+        future.add_done_callback(self._executor_job_done)
+        return future
+
+    def _executor_job_done(self, _):
+        self._executor_jobs -= 1
+
+
+@contextmanager
+def use_clock(now: Callable[[], datetime]):
+    previous = clock.now
+    clock.now = now
+    try:
+        yield
+    finally:
+        clock.now = previous
+
+
+def run_replay(recording: Recording, main: Callable[[Replayer], Any]):
+    """
+    Run `main(replayer)` on a virtual clock starting at the recording start,
+    without reading or writing the snapshot.
+    """
+    loop = VirtualClockLoop(recording.start)
+    try:
+        with use_clock(loop.now), snapshot.disabled():
+            return loop.run_until_complete(main(Replayer(recording, loop.now)))
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def drain(queue: asyncio.Queue, on_event: Callable[[Any], None] = lambda event: None):
+    while True:
+        on_event(await queue.get())
+
+
+async def record(path: str, duration: float):
+    import aiohttp
+
+    from . import gcal, github, runtime
+
+    recording = Recording(start=clock.now())
+    queue = asyncio.Queue()
+    async with aiohttp.ClientSession(headers=github.get_headers()) as session:
+        sources = runtime.Runtime(
+            queue,
+            [
+                github.GitHubSource(headers={}),
+                gcal.CalendarSource(RecordingCalendarClient(gcal.get_client(), recording)),
+            ],
+            session=RecordingSession(session, recording),
+        )
+        sources.start()
+        drain_task = asyncio.create_task(drain(queue))
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            drain_task.cancel()
+            await sources.close()
+            recording.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="record live traffic")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--duration", type=float, default=60 * 60)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        asyncio.run(record(args.path, args.duration))
+
+
+if __name__ == "__main__":
+    main()
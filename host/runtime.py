@@ -0,0 +1,211 @@
+"""
+Runtime for event sources.
+
+A source subclasses `Source` and implements `run(ctx)`. The runtime gives it a
+shared, connection pooled HTTP session, a bounded thread pool for blocking
+SDKs, a poll schedule and its own supervisor which restarts it with backoff if
+it crashes. CPU time is accounted per source, including any tasks and threads
+it starts through the runtime.
+"""
+import asyncio
+import collections.abc
+import time
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from . import metrics
+
+MAX_BLOCKING = 4
+CONNECTION_LIMIT = 20
+RESTART_MIN = 1.0
+RESTART_MAX = 60.0 * 5
+
+# name of the source the current task belongs to
+current_source: ContextVar[Optional[str]] = ContextVar("current_source", default=None)
+
+source_cpu = metrics.Counter(
+    "source_cpu_seconds_total", "CPU time used by an event source.", ["source"]
+)
+_cpu = source_cpu.values
+_thread_time = time.thread_time
+source_restarts = metrics.Counter(
+    "source_restarts_total", "Times an event source has been restarted.", ["source"]
+)
+
+
+class Source:
+    name = ""
+    # seconds between polls scheduled by `Context.every`
+    poll_every = 60.0
+
+    async def run(self, ctx: "Context"):
+        raise NotImplementedError
+
+
+class _Accounted(collections.abc.Coroutine):
+    """
+    Wrap a coroutine to add the CPU time of each step to a source.
+    """
+
+    __slots__ = ('coro', 'key')
+
+    def __init__(self, coro, source: str):
+        self.coro = coro
+        # every step of every task of a source lands here, so skip the label
+        # handling in Counter.inc
+        self.key = (source,)
+
+    def send(self, value):
+        start = _thread_time()
+        try:
+            return self.coro.send(value)
+        finally:
+            _cpu[self.key] = _cpu.get(self.key, 0.0) + _thread_time() - start
+
+    def throw(self, *args):
+        start = _thread_time()
+        try:
+            return self.coro.throw(*args)
+        finally:
+            _cpu[self.key] = _cpu.get(self.key, 0.0) + _thread_time() - start
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self
+
+
+def _task_factory(loop, coro, **kwargs):
+    # tasks started by a source inherit its context
+    if (source := current_source.get()) is not None:
+        coro = _Accounted(coro, source)
+    return asyncio.Task(coro, loop=loop, **kwargs)
+
+
+class _Session:
+    """
+    The shared session with a source's own default headers.
+    """
+
+    def __init__(self, session, headers: Dict[str, str]):
+        self.session = session
+        self.headers = headers
+
+    def get(self, url: str, **kwargs):
+        return self.session.get(url, headers=self.headers, **kwargs)
+
+
+class Context:
+    def __init__(self, runtime: "Runtime", source: Source):
+        self.runtime = runtime
+        self.source = source
+
+    async def emit(self, event):
+        await self.runtime.queue.put(event)
+
+    def http(self, headers: Optional[Dict[str, str]] = None):
+        return self.runtime.http(headers)
+
+    async def run_blocking(self, func: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        key = (self.source.name,)
+
+        def add(seconds: float):
+            _cpu[key] = _cpu.get(key, 0.0) + seconds
+
+        def accounted():
+            start = _thread_time()
+            try:
+                return func(*args)
+            finally:
+                # the counter is only updated on the loop, even if the caller
+                # was cancelled while this ran
+                with suppress(RuntimeError):
+                    loop.call_soon_threadsafe(add, _thread_time() - start)
+
+        return await loop.run_in_executor(self.runtime.executor, accounted)
+
+    async def every(self, seconds: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        Yield once per poll, recording how long each poll took. Polls that
+        overrun are not made up for.
+        """
+        interval = self.source.poll_every if seconds is None else seconds
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        while True:
+            started = time.perf_counter()
+            yield
+            metrics.poll_seconds.observe(time.perf_counter() - started, source=self.source.name)
+            next_poll = max(next_poll + interval, loop.time())
+            await asyncio.sleep(next_poll - loop.time())
+
+
+class Runtime:
+    def __init__(
+        self,
+        queue: asyncio.Queue,
+        sources: List[Source],
+        session=None,
+        max_blocking: int = MAX_BLOCKING,
+    ):
+        self.queue = queue
+        self.sources = sources
+        # given sessions, eg. for replaying, belong to the caller
+        self.session = session
+        self.own_session = session is None
+        self.executor = ThreadPoolExecutor(max_blocking, thread_name_prefix="source")
+        self.tasks: List[asyncio.Task] = []
+
+    def http(self, headers: Optional[Dict[str, str]] = None):
+        if self.session is None:
+            import aiohttp
+
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=CONNECTION_LIMIT)
+            )
+        if not self.own_session or not headers:
+            return self.session
+        return _Session(self.session, headers)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if loop.get_task_factory() is None:
+            loop.set_task_factory(_task_factory)
+        for source in self.sources:
+            self.tasks.append(
+                asyncio.create_task(_Accounted(self._supervise(source), source.name))
+            )
+
+    async def _supervise(self, source: Source):
+        current_source.set(source.name)
+        loop = asyncio.get_running_loop()
+        delay = RESTART_MIN
+        while True:
+            started = loop.time()
+            try:
+                await source.run(Context(self, source))
+                logger.warning(f"{source.name} stopped")
+            except Exception as e:
+                logger.opt(exception=e).error(f"{source.name} crashed")
+
+            # a source that ran for a while starts again quickly
+            if loop.time() - started > RESTART_MAX:
+                delay = RESTART_MIN
+            logger.info(f"restarting {source.name} in {delay}s")
+            source_restarts.inc(source=source.name)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESTART_MAX)
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.own_session and self.session is not None:
+            await self.session.close()
+        self.executor.shutdown(wait=False)
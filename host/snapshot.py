@@ -0,0 +1,67 @@
+"""
+Last known state of the event sources, kept on disk so the keypad can be
+painted straight away on start up while the sources are polled again.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# an empty path turns snapshots off
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'secrets/snapshot.json')
+# older snapshots are more likely to mislead than help
+MAX_AGE = 60 * 60 * 24
+# rewrite an unchanged snapshot this often so it does not age out
+REFRESH_EVERY = 60 * 60
+
+_sections: Optional[Dict[str, Any]] = None
+_saved = 0.0
+
+
+def _load() -> Dict[str, Any]:
+    global _sections
+    if not SNAPSHOT_PATH:
+        return {}
+    if _sections is None:
+        try:
+            with open(SNAPSHOT_PATH) as f:
+                data = json.load(f)
+            _sections = data['sections'] if time.time() - data['saved'] < MAX_AGE else {}
+        except (OSError, ValueError, KeyError):
+            _sections = {}
+    return _sections
+
+
+def load(section: str) -> Optional[Any]:
+    return _load().get(section)
+
+
+def save(section: str, value: Any):
+    global _saved
+    if not SNAPSHOT_PATH:
+        return
+    sections = _load()
+    now = time.time()
+    if sections.get(section) == value and now - _saved < REFRESH_EVERY:
+        return
+    sections[section] = value
+
+    # write then rename so a crash never leaves half a snapshot
+    os.makedirs(os.path.dirname(SNAPSHOT_PATH) or '.', exist_ok=True)
+    tmp_path = f'{SNAPSHOT_PATH}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'saved': now, 'sections': sections}, f, separators=(',', ':'))
+    os.replace(tmp_path, SNAPSHOT_PATH)
+    _saved = now
+
+
+@contextmanager
+def disabled():
+    global SNAPSHOT_PATH, _sections
+    previous = SNAPSHOT_PATH, _sections
+    SNAPSHOT_PATH, _sections = '', None
+    try:
+        yield
+    finally:
+        SNAPSHOT_PATH, _sections = previous
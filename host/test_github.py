@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+
+from host import github, pico
+from host.github import Pull, PullState, SlotAllocator
+from host.replay import Recording, ReplaySession, request_key, run_replay
+
+START = datetime(2021, 3, 1, 9, tzinfo=timezone.utc)
+
+
+def pull(n, state=PullState.PENDING):
+    return Pull(f"https://github.com/o/r/pull/{n}", state)
+
+
+def test_slot_allocator_steady_state_sends_nothing():
+    allocator = SlotAllocator(4)
+    pulls = [pull(1), pull(2)]
+
+    assert [event.offset for event in allocator.update(pulls)] == [0, 1]
+    assert allocator.update(list(reversed(pulls))) == []
+
+
+def test_slot_allocator_keeps_slots_when_pull_closes():
+    allocator = SlotAllocator(4)
+    allocator.update([pull(1), pull(2), pull(3)])
+
+    events = allocator.update([pull(1), pull(3)])
+
+    assert events == [github.Event.done(1)]
+    assert allocator.slots == {pull(1).url: 0, pull(3).url: 2}
+
+
+def test_slot_allocator_only_sends_changed_slots():
+    allocator = SlotAllocator(4)
+    allocator.update([pull(1), pull(2)])
+
+    events = allocator.update([pull(1), pull(2, PullState.FAILED)])
+
+    assert events == [github.Event(pull(2, PullState.FAILED), 1)]
+
+
+def test_slot_allocator_reuses_freed_slots_by_priority():
+    allocator = SlotAllocator(2)
+    allocator.update([pull(1), pull(2), pull(3), pull(4, PullState.FAILED)])
+    assert allocator.slots == {pull(4).url: 0, pull(1).url: 1}
+    assert allocator.overflow == 2
+
+    allocator.update([pull(1), pull(2), pull(3, PullState.MERGE)])
+
+    assert allocator.slots == {pull(1).url: 1, pull(3).url: 0}
+    assert allocator.overflow == 1
+
+
+def test_slot_allocator_restores_slots_from_snapshot():
+    allocator = SlotAllocator(4)
+    allocator.update([pull(1), pull(2), pull(3, PullState.FAILED)])
+
+    restored = SlotAllocator(4)
+    events = restored.restore(allocator.to_snapshot())
+
+    assert [(event.offset, event.pull) for event in events] == [
+        (0, pull(3, PullState.FAILED)),
+        (1, pull(1)),
+        (2, pull(2)),
+    ]
+    assert restored.update([pull(2), pull(1), pull(3, PullState.FAILED)]) == []
+
+
+def test_slot_allocator_sends_closed_pulls_to_their_button():
+    allocator = SlotAllocator(4)
+    allocator.update([pull(1), pull(2)])
+
+    events = allocator.update([pull(2), pull(1, PullState.DONE), pull(3, PullState.DONE)])
+
+    assert events == [github.Event(pull(1, PullState.DONE), 0)]
+
+
+def test_search_params_window():
+    since = datetime(2021, 3, 1, 9, 30, 15, 123, tzinfo=timezone.utc)
+
+    assert github.search_params(False, since)["q"] == (
+        "author:robyoung is:closed is:pr updated:>=2021-03-01T09:30:15Z"
+    )
+
+
+def test_get_closed_pulls_tells_merged_from_closed():
+    recording = Recording(START)
+    key = request_key(github.BASE_URL + "/search/issues", github.search_params(False, START))
+    recording.add(0, key, {"items": [
+        {"html_url": pull(1).url, "pull_request": {"merged_at": "2021-03-01T08:59:00Z"}},
+        {"html_url": pull(2).url, "pull_request": {"merged_at": None}},
+    ]})
+
+    async def main(replayer):
+        return await github.get_closed_pulls(ReplaySession(replayer), START)
+
+    pulls = run_replay(recording, main)
+
+    assert pulls == [pull(1, PullState.DONE), pull(2, PullState.CLOSED)]
+    assert [github.Event(pull, 0).colour for pull in pulls] == [pico.GREEN, pico.MAGENTA]
@@ -0,0 +1,15 @@
+import asyncio
+
+from host import main, metrics
+
+
+def test_metrics_port_in_use_does_not_stop_start_up():
+    async def run():
+        taken = await metrics.serve(port=0)
+        port = taken.sockets[0].getsockname()[1]
+        try:
+            return await main.serve_metrics(port)
+        finally:
+            taken.close()
+
+    assert asyncio.run(run()) is None
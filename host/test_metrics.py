@@ -0,0 +1,34 @@
+from host import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram('test_seconds', 'Test.', ['source'], buckets=(0.1, 1.0))
+    metrics.REGISTRY.remove(histogram)
+
+    histogram.observe(0.05, source='a')
+    histogram.observe(0.5, source='a')
+    histogram.observe(5, source='a')
+
+    assert histogram.render().splitlines() == [
+        '# HELP test_seconds Test.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{source="a",le="0.1"} 1',
+        'test_seconds_bucket{source="a",le="1.0"} 2',
+        'test_seconds_bucket{source="a",le="+Inf"} 3',
+        'test_seconds_sum{source="a"} 5.55',
+        'test_seconds_count{source="a"} 3',
+    ]
+
+
+def test_counter_and_gauge():
+    counter = metrics.Counter('test_total', 'Test.', ['source'])
+    gauge = metrics.Gauge('test_depth', 'Test.')
+    metrics.REGISTRY.remove(counter)
+    metrics.REGISTRY.remove(gauge)
+
+    counter.inc(source='a')
+    counter.inc(2, source='a')
+    gauge.set(4)
+
+    assert counter.samples() == ['test_total{source="a"} 3.0']
+    assert gauge.samples() == ['test_depth 4.0']
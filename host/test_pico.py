@@ -0,0 +1,226 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from host import metrics, pico, pool
+
+
+class Serial:
+    """
+    Answers every command like the keypad, with scripted lines read first.
+    """
+
+    port = '/dev/ttyACM0'
+
+    def __init__(self, *lines):
+        self.lines = list(lines)
+        self.commands = []
+
+    def readline(self):
+        line = self.lines.pop(0) if self.lines else None
+        if line is None:
+            # the serial read timeout
+            time.sleep(0.01)
+            return b''
+        return f'{line}\r\n'.encode('utf8')
+
+    def write(self, data):
+        for command in data.decode('utf8').split('\r')[:-1]:
+            self.commands.append(command)
+            self.lines.extend([command, 'OK'])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_resync_commands_group_leds_and_replay_keysets_in_order():
+    client = pico.Client(SimpleNamespace(port='/dev/ttyACM0'))
+    client.send_command = lambda command: 'OK'
+
+    async def main():
+        await client.set_led(tuple(range(4)), pico.OFF)
+        await client.set_led((1, 2), pico.RED, 1.0)
+        await client.set_led(3, pico.RED, 1.0)
+        await client.set_key((0, 1), [pico.Key.leds(pico.OFF)])
+        await client.set_key(1, [pico.Key.sleep(0.1)])
+
+    asyncio.run(main())
+
+    assert client.resync_commands() == [
+        'SET LED:0,0*0*0',
+        'SET LED:1/2/3,255*0*0*1.0',
+        'SET KEY:0/1,l0*0*0',
+        'SET KEY:1,s0.1',
+    ]
+    # button 0 still clears the LED of button 1, so button 1 is set after it
+    assert client.resync_commands({0}) == [
+        'SET LED:0,0*0*0',
+        'SET KEY:0/1,l0*0*0',
+        'SET KEY:1,s0.1',
+    ]
+
+
+def test_batch_sends_the_resulting_state_of_touched_buttons():
+    client = pico.Client(SimpleNamespace(port='/dev/ttyACM0'))
+    sent = []
+    client.send_command = lambda command: sent.append([command])
+    client.send_batch = sent.append
+
+    async def main():
+        await client.set_led(15, pico.CYAN)
+        async with client.batch():
+            await client.set_led((4, 5), pico.RED, 1.0)
+            await client.set_key(4, [pico.Key.sleep(0.1)])
+            await client.set_led(6, pico.RED, 1.0)
+            await client.set_led(5, pico.BLUE, 1.0)
+
+    asyncio.run(main())
+
+    assert sent == [
+        ['SET LED:15,0*255*255'],
+        ['SET LED:4/6,255*0*0*1.0', 'SET LED:5,0*0*255*1.0', 'SET KEY:4,s0.1'],
+    ]
+
+
+def test_keypress_pushes_the_command_deadline_back():
+    # the keypad logs the keyset then stops reading serial until it is done
+    client = pico.Client(Serial('LOG: execute keyset for button 15', *[None] * 5, 'OK'))
+
+    assert client.read_until('OK', timeout=0.02) == 'OK'
+
+
+def test_keypad_that_keeps_printing_times_out():
+    class Printing(Serial):
+        def readline(self):
+            time.sleep(0.01)
+            return b'Traceback (most recent call last):\r\n'
+
+    client = pico.Client(Printing())
+
+    started = time.perf_counter()
+    with pytest.raises(pico.CommandTimeout):
+        client.read_until('IDENTIFY', timeout=0.2)
+    assert time.perf_counter() - started < 1
+
+
+def test_reconnecting_to_an_unplugged_keypad_can_be_cancelled():
+    client = pico.Client(Serial())
+    client.port = '/dev/does-not-exist'
+
+    async def main():
+        task = asyncio.create_task(client.reconnect())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled()
+
+    started = time.perf_counter()
+    assert asyncio.run(main())
+    assert time.perf_counter() - started < 1
+
+
+def test_reload_between_batches_resyncs_every_button():
+    ser = Serial()
+    client = pico.Client(ser)
+
+    async def main():
+        async with client.batch():
+            await client.set_led((4, 5, 6, 7), pico.RED, 1.0)
+        # CircuitPython restarted code.py, forgetting every button
+        ser.lines.append('code.py output:')
+        async with client.batch():
+            await client.set_led(8, pico.GREEN, 1.0)
+
+    asyncio.run(main())
+
+    assert ser.commands == [
+        'SET LED:4/5/6/7,255*0*0*1.0',
+        'SET LED:8,0*255*0*1.0',
+        'SET LED:4/5/6/7,255*0*0*1.0',
+        'SET LED:8,0*255*0*1.0',
+    ]
+    assert not client.reloaded
+
+
+def test_nested_batch_is_sent_with_the_outer_one():
+    ser = Serial()
+    client = pico.Client(ser)
+
+    async def main():
+        async with client.batch():
+            async with client.batch():
+                await client.set_led(tuple(range(16)), pico.OFF)
+            await client.set_led(4, pico.RED, 1.0)
+
+    asyncio.run(main())
+
+    assert ser.commands == [
+        'SET LED:0/1/2/3/5/6/7/8/9/10/11/12/13/14/15,0*0*0',
+        'SET LED:4,255*0*0*1.0',
+    ]
+
+
+def test_batched_commands_are_timed():
+    client = pico.Client(Serial())
+
+    def count():
+        counts, _ = metrics.command_seconds.values.get(('SET LED',), ([0], None))
+        return sum(counts)
+
+    async def main():
+        async with client.batch():
+            await client.set_led(4, pico.RED, 1.0)
+            await client.set_led(5, pico.GREEN, 1.0)
+
+    before = count()
+    asyncio.run(main())
+    assert count() - before == 2
+
+
+def test_pressed_keyset_updates_the_desired_leds():
+    ser = Serial()
+    client = pico.Client(ser)
+
+    async def main():
+        async with client.batch():
+            await client.set_led((0, 1, 2, 3), pico.RED, 1.0)
+            await client.set_key((0, 1, 2, 3), [pico.Key.leds(pico.OFF)])
+            await client.set_led(4, pico.GREEN, 1.0)
+        # the reminder is cleared on the keypad
+        ser.lines.append('LOG: execute keyset for button 2')
+        await client.identify()
+
+    asyncio.run(main())
+
+    assert client.resync_commands() == [
+        'SET LED:0/1/2/3,0*0*0',
+        'SET LED:4,0*255*0*1.0',
+        'SET KEY:0/1/2/3,l0*0*0',
+    ]
+
+
+def test_reopen_finds_the_keypad_by_serial_number(monkeypatch):
+    client = pico.Client(Serial(), serial_number='E6614C311B4A8E2B')
+    monkeypatch.setattr(pool, 'discover_ports', lambda: {
+        '/dev/ttyACM0': 'ABCDEF0123456789',
+        '/dev/ttyACM2': 'E6614C311B4A8E2B',
+    })
+    opened = []
+
+    def open_serial(port, **options):
+        opened.append(port)
+        ser = Serial()
+        ser.port = port
+        return ser
+
+    monkeypatch.setattr(pico.serial, 'Serial', open_serial)
+
+    client.reopen()
+
+    assert opened == ['/dev/ttyACM2']
+    assert client.port == '/dev/ttyACM2'
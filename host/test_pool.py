@@ -0,0 +1,86 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from serial import SerialException
+
+from host import pool
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+
+    @asynccontextmanager
+    async def batch(self):
+        yield
+
+
+def device(port, sources=None):
+    return pool.Device(port, None, Client(port), user_agent="Notifier/0.1", sources=sources)
+
+
+def event(source):
+    return SimpleNamespace(source=source, created=time.monotonic())
+
+
+def test_pool_filters_and_does_not_wait_for_slow_devices():
+    handled = []
+    blocked = asyncio.Event()
+
+    async def handler(client, event):
+        if client.port == "slow":
+            await blocked.wait()
+        handled.append((client.port, event.source))
+
+    async def main():
+        devices = pool.DevicePool(
+            [device("slow"), device("desk"), device("wall", {"gcal"})], handler
+        )
+        devices.dispatch(event("github"))
+        devices.dispatch(event("gcal"))
+        await asyncio.sleep(0.01)
+        await devices.close()
+
+    asyncio.run(main())
+
+    assert sorted(handled) == [("desk", "gcal"), ("desk", "github"), ("wall", "gcal")]
+
+
+def test_pool_drops_disconnected_devices():
+    async def handler(client, event):
+        if client.port == "unplugged":
+            raise SerialException("device reports readiness to read but returned no data")
+
+    async def main():
+        devices = pool.DevicePool([device("unplugged"), device("desk")], handler)
+        devices.dispatch(event("github"))
+        await asyncio.sleep(0.01)
+        ports = list(devices.devices)
+        await devices.close()
+        return ports
+
+    assert asyncio.run(main()) == ["desk"]
+
+
+def test_pool_does_not_wait_for_slow_device_setup():
+    handled = []
+    blocked = asyncio.Event()
+
+    async def setup(client):
+        if client.port == "slow":
+            await blocked.wait()
+
+    async def handler(client, event):
+        handled.append((client.port, event.source))
+
+    async def main():
+        devices = pool.DevicePool([device("slow"), device("desk")], handler, setup)
+        devices.dispatch(event("github"))
+        await asyncio.sleep(0.01)
+        await devices.close()
+
+    asyncio.run(main())
+
+    assert handled == [("desk", "github")]
@@ -0,0 +1,36 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from host import clock
+from host.replay import Recording, ReplaySession, request_key, run_replay
+
+START = datetime(2021, 3, 1, 9, tzinfo=timezone.utc)
+
+
+def test_virtual_clock_skips_sleeps():
+    async def main(replayer):
+        await asyncio.sleep(60 * 60)
+        return clock.now()
+
+    started = time.perf_counter()
+    assert run_replay(Recording(START), main) == START + timedelta(hours=1)
+    assert time.perf_counter() - started < 1
+
+
+def test_replay_serves_latest_response():
+    recording = Recording(START)
+    url = "https://api.github.com/search/issues"
+    recording.add(0, request_key(url, {"q": "a"}), {"total_count": 1})
+    recording.add(30, request_key(url, {"q": "a"}), {"total_count": 2})
+
+    async def main(replayer):
+        session = ReplaySession(replayer)
+        counts = []
+        for _ in range(3):
+            async with session.get(url, params={"q": "a"}) as resp:
+                counts.append((await resp.json())["total_count"])
+            await asyncio.sleep(20)
+        return counts
+
+    assert run_replay(recording, main) == [1, 1, 2]
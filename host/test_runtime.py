@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+from host import gcal, runtime
+from host.replay import Recording, ReplayCalendarClient, calendar_key, run_replay
+
+START = datetime(2021, 3, 1, 9, tzinfo=timezone.utc)
+
+
+class Crashing(runtime.Source):
+    name = "crashing"
+
+    def __init__(self):
+        self.runs = 0
+
+    async def run(self, ctx):
+        self.runs += 1
+        await ctx.emit(self.runs)
+        raise ValueError("boom")
+
+
+class Polling(runtime.Source):
+    name = "polling"
+    poll_every = 10
+
+    async def run(self, ctx):
+        async for _ in ctx.every():
+            # a task started by the source is accounted to it
+            await asyncio.create_task(asyncio.sleep(0))
+            await ctx.emit(await ctx.run_blocking(sum, range(1000)))
+
+
+def test_crashed_source_is_restarted_with_backoff():
+    source = Crashing()
+
+    async def main(replayer):
+        queue = asyncio.Queue()
+        sources = runtime.Runtime(queue, [source], session=object())
+        sources.start()
+        # restarts after 1, 2 and 4 seconds
+        await asyncio.sleep(7.5)
+        await sources.close()
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    before = runtime.source_restarts.values.get(("crashing",), 0)
+    assert run_replay(Recording(START), main) == [1, 2, 3, 4]
+    assert runtime.source_restarts.values[("crashing",)] - before == 4
+
+
+def test_source_polls_at_fixed_rate():
+    async def main(replayer):
+        queue = asyncio.Queue()
+        sources = runtime.Runtime(queue, [Polling()], session=object())
+        sources.start()
+        await asyncio.sleep(35)
+        await sources.close()
+        return queue.qsize()
+
+    assert run_replay(Recording(START), main) == 4
+    assert runtime.source_cpu.values[("polling",)] > 0
+
+
+def test_empty_calendar_waits_for_the_next_poll():
+    recording = Recording(START)
+    recording.add(0, calendar_key("primary"), {"items": []})
+
+    async def main(replayer):
+        queue = asyncio.Queue()
+        source = gcal.CalendarSource(ReplayCalendarClient(replayer), ["primary"])
+        sources = runtime.Runtime(queue, [source], session=object())
+        sources.start()
+        await asyncio.sleep(60 * 60 - 1)
+        await sources.close()
+        return replayer.requests
+
+    before = runtime.source_restarts.values.get(("gcal",), 0)
+    # one request per poll and no restarts
+    assert run_replay(recording, main) == 60 * 60 // gcal.POLL_EVENTS_EVERY
+    assert runtime.source_restarts.values.get(("gcal",), 0) == before
+
+
+def test_blocking_cpu_is_added_on_the_loop():
+    def busy():
+        start = time.thread_time()
+        while time.thread_time() - start < 0.02:
+            pass
+        return threading.current_thread()
+
+    async def main():
+        sources = runtime.Runtime(asyncio.Queue(), [], session=object())
+        ctx = runtime.Context(sources, Polling())
+        before = runtime.source_cpu.values.get(("polling",), 0.0)
+        thread = await ctx.run_blocking(busy)
+        used = runtime.source_cpu.values[("polling",)] - before
+        await sources.close()
+        return thread, used
+
+    thread, used = asyncio.run(main())
+    assert thread is not threading.current_thread()
+    assert used >= 0.02
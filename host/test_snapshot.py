@@ -0,0 +1,77 @@
+import json
+import os
+import time
+
+import pytest
+
+from host import snapshot
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    path = tmp_path / "secrets" / "snapshot.json"
+    monkeypatch.setattr(snapshot, "SNAPSHOT_PATH", str(path))
+    monkeypatch.setattr(snapshot, "_sections", None)
+    monkeypatch.setattr(snapshot, "_saved", 0.0)
+    return path
+
+
+def reload():
+    # as if the host had restarted
+    snapshot._sections = None
+
+
+def test_save_and_load(path):
+    snapshot.save("github", [[0, "https://github.com/o/r/pull/1", "PENDING"]])
+    reload()
+
+    assert snapshot.load("github") == [[0, "https://github.com/o/r/pull/1", "PENDING"]]
+    assert snapshot.load("gcal") is None
+    assert os.listdir(path.parent) == ["snapshot.json"]
+
+
+def test_old_snapshot_is_ignored(path):
+    path.parent.mkdir()
+    path.write_text(json.dumps({
+        "saved": time.time() - snapshot.MAX_AGE - 1,
+        "sections": {"github": []},
+    }))
+
+    assert snapshot.load("github") is None
+
+
+def test_unchanged_snapshot_is_only_refreshed_occasionally(path):
+    snapshot.save("gcal", [])
+    saved = json.loads(path.read_text())["saved"]
+
+    snapshot.save("gcal", [])
+    assert json.loads(path.read_text())["saved"] == saved
+
+    snapshot._saved -= snapshot.REFRESH_EVERY
+    snapshot.save("gcal", [])
+    assert json.loads(path.read_text())["saved"] > saved
+
+
+def test_failed_write_keeps_the_previous_snapshot(path, monkeypatch):
+    snapshot.save("gcal", [])
+
+    def replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(snapshot.os, "replace", replace)
+    with pytest.raises(OSError):
+        snapshot.save("gcal", [{"summary": "stand up"}])
+    reload()
+
+    assert snapshot.load("gcal") == []
+
+
+def test_disabled(path):
+    snapshot.save("gcal", [])
+
+    with snapshot.disabled():
+        snapshot.save("gcal", [{"summary": "stand up"}])
+        assert snapshot.load("gcal") is None
+
+    reload()
+    assert snapshot.load("gcal") == []
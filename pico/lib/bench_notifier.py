@@ -0,0 +1,147 @@
+"""
+Benchmark the command parser and execute_keyset.
+
+Runs under CPython, the MicroPython unix port or on the keypad:
+
+    python bench_notifier.py
+    micropython bench_notifier.py
+    >>> import bench_notifier; bench_notifier.main()
+
+Reports the time and memory per call. Memory is the bytes allocated
+(gc.mem_alloc) on MicroPython and CircuitPython, and the peak traced by
+tracemalloc on CPython, so only compare numbers from the same runtime.
+Allocation does not vary between calls, so it is measured over a few calls
+only; with gc disabled they all have to fit in the heap.
+"""
+import gc
+import sys
+
+import notifier
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    try:
+        from time import perf_counter_ns as _now_ns
+    except ImportError:
+        # CircuitPython
+        from time import monotonic_ns as _now_ns
+
+    def ticks_us():
+        return _now_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ALLOC_ITERATIONS = 10
+
+LONG_URL_MACRO = (
+    "kCOMMAND/s0.2/w66697265666f78/kENTER/s0.2/kCONTROL|T/s0.2/"
+    "w68747470733a2f2f6769746875622e636f6d2f726f62796f756e672f7069636f2d"
+    "6e6f7469666965722f70756c6c2f313233/kENTER"
+)
+
+COMMANDS = (
+    ("identify", "IDENTIFY"),
+    ("set led", "SET LED:4,255*100*0*1.0"),
+    ("set led all", "SET LED:0/1/2/3/4/5/6/7/8/9/10/11/12/13/14/15,0*0*0"),
+    ("set key", "SET KEY:0/1/2/3,l0*0*0"),
+    ("set key url", "SET KEY:4," + LONG_URL_MACRO),
+)
+
+
+class Keycode:
+    COMMAND = 0xE3
+    CONTROL = 0xE0
+    ENTER = 0x28
+    T = 0x17
+
+
+class Keyboard:
+    def send(self, *keys):
+        pass
+
+
+class Layout:
+    def write(self, value):
+        pass
+
+
+class Time:
+    @staticmethod
+    def sleep(seconds):
+        pass
+
+
+def measure_time(func, iterations):
+    """
+    Return microseconds per call of func().
+    """
+    func()
+    gc.collect()
+    start = ticks_us()
+    for _ in range(iterations):
+        func()
+    return ticks_diff(ticks_us(), start) / iterations
+
+
+def measure_alloc(func, iterations=ALLOC_ITERATIONS):
+    """
+    Return bytes allocated per call of func().
+    """
+    func()
+    gc.collect()
+    if tracemalloc is not None:
+        # the peak does not add up over calls, so measure a single one
+        tracemalloc.start()
+        func()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak - current
+
+    gc.disable()
+    try:
+        start = gc.mem_alloc()
+        func()
+        allocated = gc.mem_alloc() - start
+        # nothing is freed while gc is disabled, stop at one call rather than
+        # running out of heap
+        if allocated * (iterations - 1) >= gc.mem_free():
+            return allocated
+        for _ in range(iterations - 1):
+            func()
+        return (gc.mem_alloc() - start) / iterations
+    finally:
+        gc.enable()
+
+
+def cases():
+    for name, command in COMMANDS:
+        yield "parse " + name, lambda command=command: notifier.parse_command(command, Keycode)
+
+    yield "parse_rgb", lambda: notifier.parse_rgb("255*100*0*1.0")
+
+    pixels = [(0, 0, 0)] * 16
+    kbd, layout = Keyboard(), Layout()
+    _, (_, keyset) = notifier.parse_command("SET KEY:4," + LONG_URL_MACRO, Keycode)
+    yield "execute_keyset url", lambda: notifier.execute_keyset(kbd, layout, Time, pixels, keyset)
+
+
+def main(iterations=1000):
+    print("{:<20} {:>10} {:>10}".format("case", "us/call", "bytes/call"))
+    for name, func in cases():
+        us = measure_time(func, iterations)
+        allocated = measure_alloc(func)
+        print("{:<20} {:>10.1f} {:>10.1f}".format(name, us, allocated))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -60,3 +60,44 @@ def test_parse_command(command, result):
 
     # assert
     assert parsed_command == result
+
+
+def test_bench_cases_run():
+    import bench_notifier
+
+    for _, func in bench_notifier.cases():
+        func()
+
+
+def test_bench_alloc_fits_in_the_heap(monkeypatch):
+    import bench_notifier
+
+    class Heap:
+        # a MicroPython heap with room for a few calls
+        allocated, size = 0, 1000
+
+        def collect(self):
+            pass
+
+        def disable(self):
+            pass
+
+        def enable(self):
+            pass
+
+        def mem_alloc(self):
+            return self.allocated
+
+        def mem_free(self):
+            return self.size - self.allocated
+
+    heap = Heap()
+
+    def func():
+        heap.allocated += 300
+        if heap.allocated > heap.size:
+            raise MemoryError
+
+    monkeypatch.setattr(bench_notifier, "gc", heap)
+    monkeypatch.setattr(bench_notifier, "tracemalloc", None)
+    assert bench_notifier.measure_alloc(func) == 300